@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
-import re
 import asyncio
+import functools
+import itertools
 import time
 
 from .air_quality import AirQuality
@@ -25,36 +26,148 @@ from .error import (
 
 DEFAULT_PORT = 80
 
+_MISSING = object()
+
+
+def _parse_chunk(chunk):
+    """Parse [name='value'], [name=123], [123] or a bare key into a token."""
+    # most chunks are bare keys, so check for those first
+    if chunk[:1] != "[" or chunk[-1:] != "]":
+        return ("key", chunk)
+
+    body = chunk[1:-1]
+    name, sep, rhs = body.partition("=")
+    if not sep:
+        if body.isdecimal():
+            return ("idx", int(body))
+    elif len(rhs) >= 2 and rhs[0] == "'" and rhs[-1] == "'":
+        return ("str", name, rhs[1:-1])
+    elif rhs.isdecimal():
+        return ("int", name, int(rhs))
+
+    return ("key", chunk)
+
+
+def _parse_path(path):
+    """Parse a JSON path (e.g. "relays/[relay=0]/state") into tokens."""
+    return tuple(_parse_chunk(chunk) for chunk in path.split("/"))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_path(path):
+    """Generate a function returning the item at the JSON path within data."""
+    lines = ["def follow(data):", "    current = data"]
+
+    for token in _parse_path(path):
+        kind = token[0]
+
+        if kind == "key":
+            key = token[1]
+            unexpected = f"unexpected item type: '{key}' not in: "
+            missing = f"item '{key}' not among "
+            lines += [
+                "    if not isinstance(current, dict):",
+                f"        raise JPathFailed({unexpected!r} + str(current), path, data)",
+                f"    if {key!r} not in current:",
+                f"        raise JPathFailed({missing!r} + str(list(current)), path, data)",
+                f"    current = current[{key!r}]",
+            ]
+        elif kind == "idx":
+            index = token[1]
+            message = f"with value at index {index}"
+            lines += [
+                f"    if not isinstance(current, list) or {index} >= len(current):",
+                f"        raise JPathFailed({message!r}, path, data)",
+                f"    current = current[{index}]",
+            ]
+        else:
+            _, name, value = token
+            message = f"with: {name}={value}"
+            if kind == "int":
+                lines += [
+                    "    if not isinstance(current, list):",
+                    "        raise JPathFailed(",
+                    "            'list expected but got ' + str(current), path, data",
+                    "        )",
+                ]
+            lines += [
+                "    for item in current:",
+                f"        if item[{name!r}] == {value!r}:",
+                "            current = item",
+                "            break",
+                "    else:",
+                f"        raise JPathFailed({message!r}, path, data)",
+            ]
+
+    lines.append("    return current")
+
+    namespace = {"JPathFailed": JPathFailed, "path": path}
+    exec("\n".join(lines), namespace)
+    return namespace["follow"]
+
+
+def _retrieve_exception(task):
+    # avoid "exception was never retrieved" if all waiting callers were cancelled
+    if not task.cancelled():
+        task.exception()
+
+
+_FEATURE_KINDS = (
+    ("air_qualities", AirQuality),
+    ("covers", Cover),
+    ("sensors", Temperature),  # TODO: too narrow
+    ("lights", Light),
+    ("climates", Climate),
+    ("switches", Switch),
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _resolve_config(type_, level):
+    """Get configuration for product type and api level (None if unsupported)."""
+    config_set = get_conf_set(type_)
+    if not config_set:
+        return None
+
+    return get_conf(level, config_set)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_config_paths(type_, level):
+    """Compile the feature paths of a configuration (once per type and level)."""
+    config = _resolve_config(type_, level)
+    for field, _ in _FEATURE_KINDS:
+        for args in config.get(field, []):
+            for path in args[1].values():
+                _compile_path(path)
+
 
 class Box:
     # TODO: pass IP? (For better error messages).
     def __init__(self, api_session, info):
-        self._last_real_update = None
-        self._sem = asyncio.BoundedSemaphore()
+        self._next_allowed_update = None
+        self._lock = asyncio.Lock()
+        self._pending_update = None
         self._session = api_session
         self._name = "(unnamed)"
         self._data_path = None
 
         address = f"{api_session.host}:{api_session.port}"
+        get = info.get
 
-        location = f"Device at {address}"
-
-        # NOTE: get ID first for better error messages
-        try:
-            unique_id = info["id"]
-        except KeyError as ex:
-            raise UnsupportedBoxResponse(info, f"{location} has no id") from ex
-        location = f"Device:{unique_id} at {address}"
+        # NOTE: get ID first for better error messages (which are only
+        # formatted when a field is actually missing)
+        unique_id = get("id", _MISSING)
+        if unique_id is _MISSING:
+            raise UnsupportedBoxResponse(info, f"Device at {address} has no id")
 
-        try:
-            type = info["type"]
-        except KeyError as ex:
-            raise UnsupportedBoxResponse(info, f"{location} has no type") from ex
+        type = get("type", _MISSING)
+        if type is _MISSING:
+            raise UnsupportedBoxResponse(
+                info, f"Device:{unique_id} at {address} has no type"
+            )
 
-        try:
-            product = info["product"]
-        except KeyError:
-            product = type
+        product = get("product", type)
 
         # TODO: make wLightBox API support multiple products
         # in 2020 wLightBoxS API has been deprecated and it started using wLightBox API
@@ -63,39 +176,42 @@ class Box:
         if type == "wLightBox" and product == "wLightBoxS":
             type = "wLightBoxS"
 
-        location = f"{product}:{unique_id} at {address}"
-
-        try:
-            name = info["deviceName"]
-        except KeyError as ex:
-            raise UnsupportedBoxResponse(info, f"{location} has no name") from ex
-        location = f"'{name}' ({product}:{unique_id} at {address})"
+        name = get("deviceName", _MISSING)
+        if name is _MISSING:
+            raise UnsupportedBoxResponse(
+                info, f"{product}:{unique_id} at {address} has no name"
+            )
 
-        try:
-            firmware_version = info["fv"]
-        except KeyError as ex:
+        firmware_version = get("fv", _MISSING)
+        if firmware_version is _MISSING:
             raise UnsupportedBoxResponse(
-                info, f"{location} has no firmware version"
-            ) from ex
+                info,
+                f"'{name}' ({product}:{unique_id} at {address}) has no firmware version",
+            )
+
         location = f"'{name}' ({product}:{unique_id}/{firmware_version} at {address})"
 
-        try:
-            hardware_version = info["hv"]
-        except KeyError as ex:
-            raise UnsupportedBoxResponse(
-                info, f"{location} has no hardware version"
-            ) from ex
+        hardware_version = get("hv", _MISSING)
+        if hardware_version is _MISSING:
+            raise UnsupportedBoxResponse(info, f"{location} has no hardware version")
 
-        level = int(info.get("apiLevel", default_api_level))
+        level = int(get("apiLevel", default_api_level))
 
-        config_set = get_conf_set(type)
-        if not config_set:
+        config = _resolve_config(type, level)
+        if config is None:
             raise UnsupportedBoxResponse(f"{location} is not a supported type")
 
-        config = get_conf(level, config_set)
         if not config:
             raise UnsupportedBoxVersion(f"{location} has unsupported version ({level}).")
 
+        try:
+            _compile_config_paths(type, level)
+        except (IndexError, AttributeError) as ex:
+            # malformed feature spec (paths missing or not a dict)
+            raise UnsupportedBoxResponse(
+                info, f"{location} failed to initialize: {ex}"
+            ) from ex
+
         self._data_path = config["api_path"]
         self._type = type
         self._product = product
@@ -111,14 +227,7 @@ class Box:
         self._api = config.get("api", {})
 
         self._features = {}
-        for field, klass in {
-            "air_qualities": AirQuality,
-            "covers": Cover,
-            "sensors": Temperature,  # TODO: too narrow
-            "lights": Light,
-            "climates": Climate,
-            "switches": Switch,
-        }.items():
+        for field, klass in _FEATURE_KINDS:
             try:
                 self._features[field] = [
                     klass(self, *args) for args in config.get(field, [])
@@ -129,6 +238,11 @@ class Box:
                     info, f"{location} failed to initialize: {ex}"
                 )  # from ex
 
+        self._updaters = tuple(
+            feature.after_update
+            for feature in itertools.chain.from_iterable(self._features.values())
+        )
+
         self._config = config
 
         self._update_last_data(None)
@@ -184,92 +298,19 @@ class Box:
 
     def _update_last_data(self, new_data):
         self._last_data = new_data
-        for feature_set in self._features.values():
-            for feature in feature_set:
-                feature.after_update()
+        for after_update in self._updaters:
+            after_update()
 
     async def async_api_command(self, command, value=None):
         method, *args = self._api[command](value)
-        self._last_real_update = None  # force update
+        self._next_allowed_update = None  # force update
         return await self._async_api(False, method, *args)
 
     def follow(self, data, path):
         if data is None:
             raise RuntimeError(f"bad argument: data {data}")  # pragma: no cover
 
-        results = path.split("/")
-        current_tree = data
-
-        for chunk in results:
-            with_string_value = re.compile("^\\[(.*)='(.*)'\\]$")
-
-            match = with_string_value.match(chunk)
-            if match:
-                name = match.group(1)
-                value = match.group(2)
-
-                found = False
-
-                for item in current_tree:
-                    if item[name] == value:
-                        current_tree = item
-                        found = True
-                        break
-
-                if not found:
-                    raise JPathFailed(f"with: {name}={value}", path, data)
-
-                continue  # pragma: no cover
-
-            with_int_value = re.compile("^\\[(.*)=(\\d+)\\]$")
-            match = with_int_value.match(chunk)
-            if match:
-                name = match.group(1)
-                value = int(match.group(2))
-
-                found = False
-
-                if not isinstance(current_tree, list):
-                    raise JPathFailed(
-                        f"list expected but got {current_tree}", path, data
-                    )
-
-                for item in current_tree:
-                    if item[name] == value:
-                        current_tree = item
-                        found = True
-                        break
-
-                if not found:
-                    raise JPathFailed(f"with: {name}={value}", path, data)
-                continue  # pragma: no cover
-
-            with_index = re.compile("^\\[(\\d+)\\]$")
-            match = with_index.match(chunk)
-            if match:
-                index = int(match.group(1))
-                if not isinstance(current_tree, list) or index >= len(current_tree):
-                    raise JPathFailed(f"with value at index {index}", path, data)
-
-                current_tree = current_tree[index]
-                continue
-
-            if isinstance(current_tree, dict):
-                names = current_tree.keys()
-                if chunk not in names:
-                    raise JPathFailed(
-                        f"item '{chunk}' not among {list(names)}", path, data
-                    )
-
-                current_tree = current_tree[chunk]
-            else:
-                raise JPathFailed(
-                    f"unexpected item type: '{chunk}' not in: {current_tree}",
-                    path,
-                    data,
-                )
-
-        return current_tree
+        return _compile_path(path)(data)
 
     def expect_int(self, field, raw_value, maximum=-1, minimum=0):
         return self.check_int(raw_value, field, maximum, minimum)
@@ -293,10 +334,17 @@ class Box:
         if value is None:
             raise BadFieldMissing(self.name, field)
 
-        if not type(value) is int:
+        if type(value) is not int:
             raise BadFieldNotANumber(self.name, field, value)
 
-        return self.check_int_range(value, field, maximum, minimum)
+        # same as check_int_range(), inlined since this runs on every update
+        if maximum >= minimum:
+            if value > maximum:
+                raise BadFieldExceedsMax(self.name, field, value, maximum)
+            if value < minimum:
+                raise BadFieldLessThanMin(self.name, field, value, minimum)
+
+        return value
 
     def check_hex_str(self, value, field, maximum, minimum):
         if value is None:
@@ -321,25 +369,42 @@ class Box:
         return value
 
     def _has_recent_data(self):
-        last = self._last_real_update
-        return time.time() - 2 <= last if last is not None else False
+        deadline = self._next_allowed_update
+        return deadline is not None and time.monotonic() <= deadline
 
     async def _async_api(self, is_update, method, path, post_data=None):
-        if method not in ("GET", "POST"):
-            raise NotImplementedError(method)  # pragma: no cover
+        if not is_update:
+            async with self._lock:
+                await self._async_request(method, path, post_data)
+            return
+
+        if self._has_recent_data():
+            return
+
+        update = self._pending_update
+        if update is None:
+            update = asyncio.ensure_future(self._async_update(method, path))
+            update.add_done_callback(_retrieve_exception)
+            self._pending_update = update
 
-        if is_update:
-            if self._has_recent_data():
-                return
-
-        async with self._sem:
-            if is_update:
-                if self._has_recent_data():
-                    return
-
-            if method == "GET":
-                response = await self._session.async_api_get(path)
-            else:
-                response = await self._session.async_api_post(path, post_data)
-            self._update_last_data(response)
-            self._last_real_update = time.time()
+        # NOTE: shielded, so a cancelled caller doesn't cancel the update
+        # for everyone else waiting on it
+        await asyncio.shield(update)
+
+    async def _async_update(self, method, path):
+        try:
+            async with self._lock:
+                if not self._has_recent_data():
+                    await self._async_request(method, path, None)
+        finally:
+            self._pending_update = None
+
+    async def _async_request(self, method, path, post_data):
+        if method == "GET":
+            response = await self._session.async_api_get(path)
+        elif method == "POST":
+            response = await self._session.async_api_post(path, post_data)
+        else:
+            raise NotImplementedError(method)  # pragma: no cover
+        self._update_last_data(response)
+        self._next_allowed_update = time.monotonic() + 2
@@ -1,12 +1,16 @@
+import asyncio
 import json
 
 import pytest
 
 from unittest import mock
 
-from asynctest import patch
+from asynctest import patch, CoroutineMock
 
-from blebox_uniapi.box import Box
+from blebox_uniapi.air_quality import AirQuality
+from blebox_uniapi import box as box_module
+from blebox_uniapi.box import Box, _compile_path
+from blebox_uniapi.box_types import BOX_TYPE_CONF
 from blebox_uniapi import error
 
 pytestmark = pytest.mark.asyncio
@@ -73,6 +77,30 @@ async def test_json_paths(mock_session, data):
         box.follow(json.loads("""{"foo": [4]}"""), "[bar=0]/value")
 
 
+async def test_adhoc_paths_compiled_once(mock_session, data):
+    box = Box(mock_session, data)
+    state = json.loads("""{"air": {"sensors": [{"value": 3}, {"value": 4}]}}""")
+
+    _compile_path.cache_clear()
+    assert 4 == box.follow(state, "air/sensors/[1]/value")
+    assert 4 == box.follow(state, "air/sensors/[1]/value")
+
+    info = _compile_path.cache_info()
+    assert 1 == info.misses
+    assert 1 == info.hits
+
+
+async def test_json_paths_with_unusual_chunks(mock_session, data):
+    box = Box(mock_session, data)
+
+    assert 4 == box.follow(json.loads("""[{"foo":"", "value":4}]"""), "[foo='']/value")
+    assert 4 == box.follow(json.loads("""[{"foo":"a=b", "value":4}]"""), "[foo='a=b']/value")
+
+    # chunks not matching any bracketed form are plain keys
+    assert 1 == box.follow(json.loads("""{"[foo]": 1}"""), "[foo]")
+    assert 2 == box.follow(json.loads("""{"[foo=bar]": 2}"""), "[foo=bar]")
+
+
 async def test_without_id(mock_session, data):
     with pytest.raises(
         error.UnsupportedBoxResponse, match="Device at 172.1.2.3:80 has no id"
@@ -136,10 +164,7 @@ async def test_without_api_level(mock_session, data):
 
 
 async def test_with_init_failure(mock_session, data):
-    with patch(
-        "blebox_uniapi.box.AirQuality", spec_set=True, autospec=True
-    ) as mock_sensor:
-        mock_sensor.side_effect = KeyError
+    with patch.object(AirQuality, "__init__", side_effect=KeyError):
         with pytest.raises(
             error.UnsupportedBoxResponse,
             match=r"'foobar' \(airSensor:abcd1234ef/1.23 at 172.1.2.3:80\) failed to initialize: ",
@@ -147,6 +172,35 @@ async def test_with_init_failure(mock_session, data):
             Box(mock_session, data)
 
 
+async def test_with_malformed_feature_spec(mock_session, data):
+    data["type"] = "malformedBox"
+    config_set = {
+        20180403: {"api_path": "/api/air/state", "air_qualities": [["0.air"]]}
+    }
+
+    with patch.dict(BOX_TYPE_CONF, {"malformedBox": config_set}):
+        with pytest.raises(
+            error.UnsupportedBoxResponse,
+            match=r"'foobar' \(malformedBox:abcd1234ef/1.23 at 172.1.2.3:80\) failed to initialize: ",
+        ):
+            Box(mock_session, data)
+
+
+async def test_feature_paths_compiled_once_per_config(mock_session, data):
+    box_module._compile_config_paths.cache_clear()
+    paths = BOX_TYPE_CONF["airSensor"][20180403]["air_qualities"][0][1].values()
+
+    with patch.object(
+        box_module, "_compile_path", wraps=box_module._compile_path
+    ) as compile_path:
+        Box(mock_session, data)
+        assert sorted(paths) == sorted(c[0][0] for c in compile_path.call_args_list)
+
+        compile_path.reset_mock()
+        Box(mock_session, dict(data, id="abcd1234f0"))
+        compile_path.assert_not_called()
+
+
 async def test_properties(mock_session, data):
     box = Box(mock_session, data)
     assert "foobar" == box.name
@@ -158,6 +212,7 @@ async def test_properties(mock_session, data):
     assert "4.56" == box.hardware_version
     assert "BleBox" == box.brand
     assert 20180403 == box.api_version
+    assert [] == box.features["lights"]
 
 
 async def test_validations(mock_session, data):
@@ -203,3 +258,99 @@ async def test_validations(mock_session, data):
         error.BadFieldNotRGBW, match=r"foobar.field1 is 123 which is not a rgbw string"
     ):
         box.check_rgbw("123", "field1")
+
+
+async def test_updates_throttled(mock_session, data):
+    box = Box(mock_session, data)
+    mock_session.async_api_get = CoroutineMock(return_value=None)
+
+    with patch("blebox_uniapi.box.time") as mock_time:
+        mock_time.monotonic.return_value = 100.0
+        await box.async_update_data()
+        assert 1 == mock_session.async_api_get.call_count
+
+        mock_time.monotonic.return_value = 101.5
+        await box.async_update_data()
+        assert 1 == mock_session.async_api_get.call_count
+
+        mock_time.monotonic.return_value = 102.5
+        await box.async_update_data()
+        assert 2 == mock_session.async_api_get.call_count
+
+
+async def test_concurrent_updates_share_request(mock_session, data):
+    box = Box(mock_session, data)
+
+    async def delayed_get(path):
+        await asyncio.sleep(0)
+        return None
+
+    mock_session.async_api_get = CoroutineMock(side_effect=delayed_get)
+
+    await asyncio.gather(*[box.async_update_data() for _ in range(3)])
+    mock_session.async_api_get.assert_called_once_with("/api/air/state")
+
+
+async def test_concurrent_updates_share_failure(mock_session, data):
+    box = Box(mock_session, data)
+
+    async def failing_get(path):
+        await asyncio.sleep(0)
+        raise error.ConnectionError("failed")
+
+    mock_session.async_api_get = CoroutineMock(side_effect=failing_get)
+
+    results = await asyncio.gather(
+        box.async_update_data(), box.async_update_data(), return_exceptions=True
+    )
+    assert all(isinstance(result, error.ConnectionError) for result in results)
+    mock_session.async_api_get.assert_called_once_with("/api/air/state")
+
+
+async def test_cancelled_update_does_not_cancel_others(mock_session, data):
+    box = Box(mock_session, data)
+    release = asyncio.Event()
+
+    async def blocked_get(path):
+        await release.wait()
+        return None
+
+    mock_session.async_api_get = CoroutineMock(side_effect=blocked_get)
+
+    first = asyncio.ensure_future(box.async_update_data())
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(box.async_update_data())
+    await asyncio.sleep(0)
+
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(first, second, return_exceptions=True)
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1] is None
+    mock_session.async_api_get.assert_called_once_with("/api/air/state")
+
+
+async def test_int_validations(mock_session, data):
+    box = Box(mock_session, data)
+
+    assert 50 == box.check_int(50, "field1", 100, 0)
+    assert 500 == box.check_int(500, "field1", -1, 0)
+
+    with pytest.raises(
+        error.BadFieldExceedsMax,
+        match=r"foobar.field1 is 123 which exceeds max \(100\)",
+    ):
+        box.check_int(123, "field1", 100, 0)
+
+    with pytest.raises(
+        error.BadFieldLessThanMin,
+        match=r"foobar.field1 is 123 which is less than minimum \(200\)",
+    ):
+        box.check_int(123, "field1", 300, 200)
+
+    with pytest.raises(
+        error.BadFieldNotANumber, match=r"foobar.field1 is 'True' which is not a number"
+    ):
+        box.check_int(True, "field1", 300, 200)